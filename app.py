@@ -1,21 +1,80 @@
+import time
+# Start of the import phase reported by create_app()
+_import_start = time.perf_counter()
 from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, session, send_file
 import sqlite3
+from jinja2 import TemplateError
 import json
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
+import logging
+import multiprocessing
+import threading
 import os
+from concurrent.futures import ProcessPoolExecutor
+from flask.logging import default_handler
 
-app = Flask(__name__)
-app.secret_key = 'gcc_cabinet_secret_key_2025'
+logger = logging.getLogger('gcc_cabinet')
+
+# Views are collected here and registered on each app built by create_app()
+ROUTES = []
+
+def route(rule, **options):
+    def register(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return register
 
 # SQLite database setup
 DATABASE = 'gcc_cabinet.db'
 
+def link_fines(c):
+    # Late fines are linked to their check-in by incomes.attendanceId. Rows written before
+    # that column existed are paired one-to-one with unlinked late check-ins by the old
+    # 'Late fine: <name>' source text, in time order within each name and day.
+    c.execute('''SELECT i.id, a.id FROM
+        (SELECT id, 'Late fine: ' || name AS source, date,
+                ROW_NUMBER() OVER (PARTITION BY name, date ORDER BY time, id) AS n
+         FROM attendance WHERE status = 'Late'
+         AND id NOT IN (SELECT attendanceId FROM incomes WHERE attendanceId IS NOT NULL)) a
+        JOIN (SELECT id, source, date, ROW_NUMBER() OVER (PARTITION BY source, date ORDER BY time, id) AS n
+              FROM incomes WHERE source LIKE 'Late fine: %' AND attendanceId IS NULL) i
+        ON i.source = a.source AND i.date = a.date AND i.n = a.n''')
+    c.executemany('UPDATE incomes SET attendanceId=? WHERE id=?', [(row[1], row[0]) for row in c.fetchall()])
+
+# Weeks are keyed by their Monday's date, here and in attendance_week(). A rollup's role is
+# the one on the member's latest recorded check-in that week (highest ATT id), which is
+# also what the upsert in mark_attendance keeps.
+REBUILD_ROLLUPS_SQL = '''INSERT INTO attendance_rollups (name, week, role, checkIns, late, fines)
+    SELECT name, week, role, checkIns, late, fines FROM (
+        SELECT name, date(date, '-6 days', 'weekday 1') AS week, role, MAX(id), COUNT(*) AS checkIns,
+               SUM(status = 'Late') AS late, COALESCE(SUM(fine), 0) AS fines
+        FROM attendance GROUP BY name, week)'''
+# Messages start their own thread unless sent as a reply; unread counts per recipient
+# are kept in unread_counts by send_message and mark_messages_read
+THREAD_BACKFILL_SQL = 'UPDATE messages SET threadId = id WHERE threadId IS NULL'
+REBUILD_UNREAD_SQL = '''INSERT INTO unread_counts (to_user, unread)
+    SELECT to_user, COUNT(*) FROM messages WHERE read = 0 GROUP BY to_user'''
+
+# Schema changes applied in order on top of the CREATE TABLE statements below, either SQL
+# or a function taking a cursor. PRAGMA user_version records how many have run on a database.
+MIGRATIONS = [
+    'ALTER TABLE incomes ADD COLUMN attendanceId TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_incomes_attendance ON incomes (attendanceId)',
+    'ALTER TABLE state ADD COLUMN attendanceVersion INTEGER DEFAULT 0',
+    link_fines,
+    REBUILD_ROLLUPS_SQL,
+    'ALTER TABLE messages ADD COLUMN threadId TEXT',
+    'CREATE INDEX IF NOT EXISTS idx_messages_thread ON messages (threadId, date, time)',
+    THREAD_BACKFILL_SQL,
+    REBUILD_UNREAD_SQL,
+]
+
 def init_db():
     with sqlite3.connect(DATABASE) as conn:
         c = conn.cursor()
+        # Serialise schema setup when several workers start against a fresh database
+        c.execute('BEGIN IMMEDIATE')
         c.execute('''CREATE TABLE IF NOT EXISTS payments (
             id TEXT PRIMARY KEY, name TEXT, cls TEXT, stream TEXT, house TEXT, type TEXT, term TEXT,
             amount REAL, required REAL, balance REAL, date TEXT, time TEXT)''')
@@ -43,11 +102,43 @@ def init_db():
             id TEXT PRIMARY KEY, from_user TEXT, to_user TEXT, content TEXT, date TEXT, time TEXT, read INTEGER)''')
         c.execute('''CREATE TABLE IF NOT EXISTS state (
             id INTEGER PRIMARY KEY, totalCollected REAL, totalExpenditure REAL, financePin TEXT)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS statements (
+            name TEXT PRIMARY KEY, data TEXT, asOf TEXT, version INTEGER DEFAULT 0)''')
+        c.execute('''CREATE TABLE IF NOT EXISTS attendance_rollups (
+            name TEXT, week TEXT, role TEXT, checkIns INTEGER, late INTEGER, fines REAL, PRIMARY KEY (name, week))''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_rollups_week ON attendance_rollups (week)')
+        c.execute('''CREATE TABLE IF NOT EXISTS unread_counts (
+            to_user TEXT PRIMARY KEY, unread INTEGER)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_inbox ON messages (to_user, read, date, time)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_messages_to ON messages (to_user, date, time)')
+        c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY, kind TEXT, status TEXT, priority INTEGER, payload BLOB, result BLOB,
+            resultName TEXT, message TEXT, error TEXT, created REAL, started REAL, finished REAL,
+            owner INTEGER)''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (status, priority, created)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished)')
+        # Name lookups used by statements and per-person checks
+        c.execute('CREATE INDEX IF NOT EXISTS idx_payments_name ON payments (name, type)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_minister_payments_name ON minister_payments (name, type)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_loans_name ON loans (name, status)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_repayments_name ON repayments (name)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_savings_name ON savings (name, withdrawn)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_attendance_name ON attendance (name)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_incomes_source ON incomes (source)')
         # Initialize state if not exists
         c.execute('SELECT COUNT(*) FROM state')
         if c.fetchone()[0] == 0:
             c.execute('INSERT INTO state (totalCollected, totalExpenditure, financePin) VALUES (?, ?, ?)', (0, 0, None))
+        version = c.execute('PRAGMA user_version').fetchone()[0]
+        for step in MIGRATIONS[version:]:
+            if callable(step):
+                step(c)
+            else:
+                c.execute(step)
+        c.execute(f'PRAGMA user_version = {len(MIGRATIONS)}')
         conn.commit()
+    # Close explicitly so a preloaded gunicorn master does not hand an open connection to its workers
+    conn.close()
 
 # Pre-set role PINs
 ROLE_PINS = {
@@ -75,6 +166,9 @@ def get_db():
 def format_ugx(x):
     return "{:,.0f}".format(float(x or 0))
 
+def parse_flag(value):
+    return (value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
 def now_date():
     return datetime.now().strftime('%Y-%m-%d')
 
@@ -84,13 +178,136 @@ def now_time():
 def timestamp():
     return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
 
-@app.route('/')
+def loan_penalty(loan, on_date):
+    # Late penalty charged on the remaining balance once a loan is past its due date
+    due = datetime.strptime(loan['dueDate'], '%Y-%m-%d').date()
+    if on_date > due and loan['totalRemaining'] > 0:
+        return round(loan['totalRemaining'] * LOAN_LATE_PENALTY_PCT)
+    return 0
+
+def saving_payout(s, on_date):
+    # Returns (earned_interest, matured, payout_available) for a saving withdrawn on on_date
+    ds = datetime.strptime(s['dateSaved'], '%Y-%m-%d')
+    da = datetime.strptime(on_date, '%Y-%m-%d')
+    days_held = max(0, (da - ds).days)
+    pct = s['interestPct']
+    full_term_days = s['termWeeks'] * 7
+    earned_interest = 0 if days_held <= 0 else round(s['amount'] * pct * (min(days_held, full_term_days) / full_term_days))
+    matured = da.date() >= datetime.strptime(s['sched'], '%Y-%m-%d').date()
+    payout_available = (s['amount'] + s['interestIfHeld']) if matured else (s['amount'] + earned_interest)
+    return earned_interest, matured, payout_available
+
+def build_statement(c, name):
+    # Account position for one person: fee balances per FIXED item summed over their payment
+    # rows (each row is one charge, usually one per term), active loan with any late penalty
+    # due, active savings with interest accrued to today,
+    # and late fines charged at check-in that have no matching income record.
+    today = now_date()
+    fees = {}
+    for table, paid_col in (('payments', 'amount'), ('minister_payments', 'paid')):
+        c.execute(f'''SELECT type, SUM(required) AS required, SUM({paid_col}) AS paid, SUM(balance) AS balance
+                      FROM {table} WHERE name=? AND type IN ({",".join("?" * len(FIXED))}) GROUP BY type''',
+                  (name, *FIXED))
+        for row in c.fetchall():
+            fee = fees.setdefault(row['type'], {'required': 0, 'paid': 0, 'outstanding': 0})
+            fee['required'] += row['required'] or 0
+            fee['paid'] += row['paid'] or 0
+            fee['outstanding'] += row['balance'] or 0
+    c.execute('SELECT * FROM loans WHERE name=? AND status!=?', (name, 'Cleared'))
+    loan = c.fetchone()
+    if loan:
+        penalty = loan_penalty(loan, datetime.strptime(today, '%Y-%m-%d').date())
+        c.execute('SELECT COALESCE(SUM(paid), 0) FROM repayments WHERE loanId=?', (loan['id'],))
+        loan = {'id': loan['id'], 'principal': loan['principal'], 'total': loan['total'],
+                'repaid': c.fetchone()[0], 'totalRemaining': loan['totalRemaining'], 'dueDate': loan['dueDate'],
+                'penaltyDue': penalty, 'payoff': loan['totalRemaining'] + penalty}
+    c.execute('SELECT * FROM savings WHERE name=? AND withdrawn=0', (name,))
+    savings = []
+    for s in c.fetchall():
+        earned_interest, matured, payout_available = saving_payout(s, today)
+        savings.append({'id': s['id'], 'amount': s['amount'], 'dateSaved': s['dateSaved'], 'sched': s['sched'],
+                        'accruedInterest': earned_interest, 'matured': matured, 'available': payout_available})
+    c.execute('SELECT COALESCE(SUM(fine), 0) FROM attendance WHERE name=?', (name,))
+    fines_charged = c.fetchone()[0]
+    c.execute('''SELECT COALESCE(SUM(i.amt), 0) FROM incomes i JOIN attendance a ON i.attendanceId = a.id
+                 WHERE a.name=?''', (name,))
+    fines_paid = c.fetchone()[0]
+    return {
+        'name': name,
+        'asOf': today,
+        'fees': fees,
+        'feesOutstanding': sum(f['outstanding'] for f in fees.values()),
+        'loan': loan,
+        'savings': savings,
+        'savingsAvailable': sum(s['available'] for s in savings),
+        'fines': {'charged': fines_charged, 'paid': fines_paid, 'unpaid': max(0, fines_charged - fines_paid)}
+    }
+
+def load_statement(c, name):
+    # Returns (statement, version). The statement is None when missing, invalidated or built
+    # on an earlier day, since loan penalties and savings interest depend on today's date.
+    c.execute('SELECT data, asOf, version FROM statements WHERE name=?', (name,))
+    row = c.fetchone()
+    if not row:
+        return None, None
+    if row['data'] and row['asOf'] == now_date():
+        return json.loads(row['data']), row['version']
+    return None, row['version']
+
+def store_statements(c, built):
+    # built holds (name, version seen before building, statement). Statements are built
+    # without holding the write lock; a write that invalidated the person meanwhile has
+    # bumped the version, so the stale statement is not stored.
+    for name, version, statement in built:
+        if version is None:
+            c.execute('INSERT OR IGNORE INTO statements (name, data, asOf, version) VALUES (?, ?, ?, 0)',
+                      (name, json.dumps(statement), statement['asOf']))
+        else:
+            c.execute('UPDATE statements SET data=?, asOf=? WHERE name=? AND version=?',
+                      (json.dumps(statement), statement['asOf'], name, version))
+    c.connection.commit()
+
+def get_statement(c, name):
+    statement, version = load_statement(c, name)
+    if statement is None:
+        statement = build_statement(c, name)
+        store_statements(c, [(name, version, statement)])
+    return statement
+
+def invalidate_statement(c, *names):
+    c.executemany('''INSERT INTO statements (name, version) VALUES (?, 1)
+                     ON CONFLICT (name) DO UPDATE SET data=NULL, version=version+1''', [(n,) for n in names if n])
+
+def attendance_week(date_):
+    day = datetime.strptime(date_, '%Y-%m-%d').date()
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+def bump_attendance_version(c):
+    c.execute('UPDATE state SET attendanceVersion=attendanceVersion+1 WHERE id=1')
+
+# Attendance analytics results per worker, keyed by query and tagged with the
+# state.attendanceVersion they were computed at; any check-in bumps the version
+_analytics_cache = {}
+ANALYTICS_CACHE_SIZE = 256
+
+def cached_analytics(c, key, compute):
+    version = c.execute('SELECT attendanceVersion FROM state WHERE id=1').fetchone()[0]
+    hit = _analytics_cache.get(key)
+    if hit and hit[0] == version:
+        return hit[1]
+    result = compute(c)
+    if len(_analytics_cache) >= ANALYTICS_CACHE_SIZE:
+        _analytics_cache.clear()
+    _analytics_cache[key] = (version, result)
+    return result
+
+@route('/')
 def index():
     if 'role' not in session:
         return render_template('index.html', logged_in=False)
     return render_template('index.html', logged_in=True, role=session['role'])
 
-@app.route('/login', methods=['POST'])
+@route('/login', methods=['POST'])
 def login():
     role = request.form.get('role')
     pin = request.form.get('pin')
@@ -103,12 +320,12 @@ def login():
     session['role'] = role
     return redirect(url_for('index'))
 
-@app.route('/logout')
+@route('/logout')
 def logout():
     session.pop('role', None)
     return redirect(url_for('index'))
 
-@app.route('/dashboard_data')
+@route('/dashboard_data')
 def dashboard_data():
     with get_db() as conn:
         c = conn.cursor()
@@ -131,7 +348,7 @@ def dashboard_data():
         'houseChart': {'labels': houses, 'data': totals}
     })
 
-@app.route('/add_payment', methods=['POST'])
+@route('/add_payment', methods=['POST'])
 def add_payment():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -157,6 +374,7 @@ def add_payment():
                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                   (rec_id, name, cls, stream, house, type_, term, amount, required, balance, date_, now_time()))
         c.execute('UPDATE state SET totalCollected = totalCollected + ? WHERE id=1', (amount,))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Good Choice Cabinet Receipt\n
 Payment\nName: {name}\nClass: {cls}\nStream: {stream}\nHouse: {house}\nPayment Type: {type_}\nTerm: {term}
@@ -164,7 +382,7 @@ Amount Paid: {format_ugx(amount)}\nRequired: {format_ugx(required)}\nBalance: {f
 Date: {date_} {now_time()}\nTimestamp: {timestamp()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/pay_balance/<payment_id>', methods=['POST'])
+@route('/pay_balance/<payment_id>', methods=['POST'])
 def pay_balance(payment_id):
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -180,12 +398,13 @@ def pay_balance(payment_id):
             return jsonify({'error': 'Invalid amount'}), 400
         c.execute('UPDATE payments SET amount=amount+?, balance=balance-? WHERE id=?', (to_pay, to_pay, payment_id))
         c.execute('UPDATE state SET totalCollected=totalCollected+? WHERE id=1', (to_pay,))
+        invalidate_statement(c, p['name'])
         conn.commit()
         receipt_text = f'''Balance Payment\nName: {p['name']}\nPaid: {format_ugx(to_pay)}
 Remaining Balance: {format_ugx(p['balance']-to_pay)}\nTime: {timestamp()}'''
         return jsonify({'receipt': receipt_text})
 
-@app.route('/payments')
+@route('/payments')
 def get_payments():
     with get_db() as conn:
         c = conn.cursor()
@@ -193,7 +412,7 @@ def get_payments():
         payments = [dict(row) for row in c.fetchall()]
     return jsonify(payments)
 
-@app.route('/add_expenditure', methods=['POST'])
+@route('/add_expenditure', methods=['POST'])
 def add_expenditure():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -212,7 +431,7 @@ def add_expenditure():
     receipt_text = f'''Expenditure Receipt\nDesc: {desc}\nAmount: {format_ugx(amt)}\nDate: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/expenditures')
+@route('/expenditures')
 def get_expenditures():
     with get_db() as conn:
         c = conn.cursor()
@@ -220,7 +439,7 @@ def get_expenditures():
         expenditures = [dict(row) for row in c.fetchall()]
     return jsonify(expenditures)
 
-@app.route('/add_loan', methods=['POST'])
+@route('/add_loan', methods=['POST'])
 def add_loan():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -245,12 +464,13 @@ def add_loan():
         c.execute('INSERT INTO expenditures (id, desc, amt, date, time) VALUES (?, ?, ?, ?, ?)',
                   (f'EXP-LOAN-{int(datetime.now().timestamp()*1000)}', f'Loan disbursed {id_} to {name}', amt, date_, now_time()))
         c.execute('UPDATE state SET totalExpenditure=totalExpenditure+? WHERE id=1', (amt,))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Loan Disbursement Receipt\nLoan ID: {id_}\nName: {name}\nPrincipal: {format_ugx(amt)}
 Interest%: {interest_pct}\nTotal to Repay: {format_ugx(total)}\nDue Date: {due_date}\nDisbursement Date: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/repay_loan', methods=['POST'])
+@route('/repay_loan', methods=['POST'])
 def repay_loan():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -269,10 +489,8 @@ def repay_loan():
         if loan['status'] == 'Cleared':
             return jsonify({'error': 'Loan already cleared'}), 400
         today = datetime.strptime(date_, '%Y-%m-%d').date()
-        due = datetime.strptime(loan['dueDate'], '%Y-%m-%d').date()
-        penalty = 0
-        if today > due and loan['totalRemaining'] > 0:
-            penalty = round(loan['totalRemaining'] * LOAN_LATE_PENALTY_PCT)
+        penalty = loan_penalty(loan, today)
+        if penalty:
             c.execute('UPDATE loans SET totalRemaining=totalRemaining+? WHERE id=?', (penalty, id_))
             c.execute('INSERT INTO incomes (id, source, amt, date, time) VALUES (?, ?, ?, ?, ?)',
                       (f'PEN{int(datetime.now().timestamp()*1000)}', f'Late penalty on loan {id_}', penalty, date_, now_time()))
@@ -286,12 +504,13 @@ def repay_loan():
         c.execute('INSERT INTO incomes (id, source, amt, date, time) VALUES (?, ?, ?, ?, ?)',
                   (f'INC-LOAN-PAY-{int(datetime.now().timestamp()*1000)}', f'Loan repayment {id_}', paid, date_, now_time()))
         c.execute('UPDATE state SET totalCollected=totalCollected+? WHERE id=1', (paid,))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Loan Repayment Receipt\nLoan ID: {id_}\nName: {name}\nPaid: {format_ugx(paid)}
 Remaining: {format_ugx(new_remaining)}\nDate: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/loans')
+@route('/loans')
 def get_loans():
     with get_db() as conn:
         c = conn.cursor()
@@ -299,7 +518,7 @@ def get_loans():
         loans = [dict(row) for row in c.fetchall()]
     return jsonify(loans)
 
-@app.route('/repayments')
+@route('/repayments')
 def get_repayments():
     with get_db() as conn:
         c = conn.cursor()
@@ -307,7 +526,7 @@ def get_repayments():
         repayments = [dict(row) for row in c.fetchall()]
     return jsonify(repayments)
 
-@app.route('/add_saving', methods=['POST'])
+@route('/add_saving', methods=['POST'])
 def add_saving():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -335,13 +554,14 @@ def add_saving():
         c.execute('''INSERT INTO savings (id, name, amount, dateSaved, sched, termWeeks, interestPct, interestIfHeld, daysScheduled, withdrawn)
                      VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
                   (rec_id, name, amount, date_saved, sched, required_weeks, interest_pct, full_interest, days, 0))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Saving Order\nName: {name}\nAmount: {format_ugx(amount)}\nTerm weeks (tier): {required_weeks}
 Interest% (if held): {round(interest_pct*100)}%\nInterest(if held): {format_ugx(full_interest)}
 Scheduled withdraw: {sched}\nSaved on: {date_saved} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/process_withdrawal', methods=['POST'])
+@route('/process_withdrawal', methods=['POST'])
 def process_withdrawal():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -356,14 +576,7 @@ def process_withdrawal():
         s = c.fetchone()
         if not s:
             return jsonify({'error': 'No active saving found for that name'}), 404
-        ds = datetime.strptime(s['dateSaved'], '%Y-%m-%d')
-        da = datetime.strptime(actual_date, '%Y-%m-%d')
-        days_held = max(0, (da - ds).days)
-        pct = s['interestPct']
-        full_term_days = s['termWeeks'] * 7
-        earned_interest = 0 if days_held <= 0 else round(s['amount'] * pct * (min(days_held, full_term_days) / full_term_days))
-        matured = da.date() >= datetime.strptime(s['sched'], '%Y-%m-%d').date()
-        payout_available = (s['amount'] + s['interestIfHeld']) if matured else (s['amount'] + earned_interest)
+        earned_interest, matured, payout_available = saving_payout(s, actual_date)
         if amount_requested > payout_available:
             return jsonify({'error': f'Requested {format_ugx(amount_requested)} exceeds available {format_ugx(payout_available)}'}), 400
         c.execute('INSERT INTO expenditures (id, desc, amt, date, time) VALUES (?, ?, ?, ?, ?)',
@@ -373,13 +586,14 @@ def process_withdrawal():
             c.execute('UPDATE savings SET withdrawn=1 WHERE id=?', (s['id'],))
         else:
             c.execute('UPDATE savings SET amount=? WHERE id=?', (max(0, s['amount'] - amount_requested), s['id']))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Saving Withdrawal Receipt\nName: {name}\nRequested: {format_ugx(amount_requested)}
 Paid: {format_ugx(amount_requested)}\nInterest earned (days): {format_ugx(earned_interest)}\nMatured: {matured}
 Date: {actual_date} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/savings')
+@route('/savings')
 def get_savings():
     with get_db() as conn:
         c = conn.cursor()
@@ -387,7 +601,7 @@ def get_savings():
         savings = [dict(row) for row in c.fetchall()]
     return jsonify(savings)
 
-@app.route('/add_minister_payment', methods=['POST'])
+@route('/add_minister_payment', methods=['POST'])
 def add_minister_payment():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -407,12 +621,13 @@ def add_minister_payment():
         c.execute('''INSERT INTO minister_payments (id, name, type, required, paid, balance, date)
                      VALUES (?, ?, ?, ?, ?, ?, ?)''', (rec_id, name, type_, required, paid, balance, date_))
         c.execute('UPDATE state SET totalCollected=totalCollected+? WHERE id=1', (paid,))
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Minister Payment\nName: {name}\nType: {type_}\nPaid: {format_ugx(paid)}
 Required: {format_ugx(required)}\nBalance: {format_ugx(balance)}\nDate: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/pay_minister_balance/<min_id>', methods=['POST'])
+@route('/pay_minister_balance/<min_id>', methods=['POST'])
 def pay_minister_balance(min_id):
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -428,12 +643,13 @@ def pay_minister_balance(min_id):
             return jsonify({'error': 'Invalid amount'}), 400
         c.execute('UPDATE minister_payments SET paid=paid+?, balance=balance-? WHERE id=?', (to_pay, to_pay, min_id))
         c.execute('UPDATE state SET totalCollected=totalCollected+? WHERE id=1', (to_pay,))
+        invalidate_statement(c, rec['name'])
         conn.commit()
         receipt_text = f'''Minister Balance Payment\nName: {rec['name']}\nType: {rec['type']}\nPaid: {format_ugx(to_pay)}
 Remaining Balance: {format_ugx(rec['balance']-to_pay)}\nTime: {timestamp()}'''
         return jsonify({'receipt': receipt_text})
 
-@app.route('/minister_payments')
+@route('/minister_payments')
 def get_minister_payments():
     with get_db() as conn:
         c = conn.cursor()
@@ -441,7 +657,7 @@ def get_minister_payments():
         payments = [dict(row) for row in c.fetchall()]
     return jsonify(payments)
 
-@app.route('/add_income', methods=['POST'])
+@route('/add_income', methods=['POST'])
 def add_income():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -460,7 +676,7 @@ def add_income():
     receipt_text = f'''Income Receipt\nSource: {source}\nAmount: {format_ugx(amt)}\nDate: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/incomes')
+@route('/incomes')
 def get_incomes():
     with get_db() as conn:
         c = conn.cursor()
@@ -468,7 +684,7 @@ def get_incomes():
         incomes = [dict(row) for row in c.fetchall()]
     return jsonify(incomes)
 
-@app.route('/mark_attendance', methods=['POST'])
+@route('/mark_attendance', methods=['POST'])
 def mark_attendance():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -479,6 +695,10 @@ def mark_attendance():
     meeting_start = request.form.get('start') or MEETING_START_DEFAULT
     if not all([name, role, date_, time_]):
         return jsonify({'error': 'Fill attendance fields'}), 400
+    try:
+        week = attendance_week(date_)
+    except ValueError:
+        return jsonify({'error': 'Give date as YYYY-MM-DD'}), 400
     h_check, m_check = map(int, time_.split(':'))
     h_start, m_start = map(int, meeting_start.split(':'))
     late = (h_check > h_start) or (h_check == h_start and m_check > m_start)
@@ -490,15 +710,21 @@ def mark_attendance():
         c.execute('INSERT INTO attendance (id, name, role, date, time, status, fine) VALUES (?, ?, ?, ?, ?, ?, ?)',
                   (rec_id, name, role, date_, time_, status, fine))
         if late:
-            c.execute('INSERT INTO incomes (id, source, amt, date, time) VALUES (?, ?, ?, ?, ?)',
-                      (f'FINE{int(datetime.now().timestamp()*1000)}', f'Late fine: {name}', fine, date_, now_time()))
+            c.execute('INSERT INTO incomes (id, source, amt, date, time, attendanceId) VALUES (?, ?, ?, ?, ?, ?)',
+                      (f'FINE{int(datetime.now().timestamp()*1000)}', f'Late fine: {name}', fine, date_, now_time(), rec_id))
             c.execute('UPDATE state SET totalCollected=totalCollected+? WHERE id=1', (fine,))
+        c.execute('''INSERT INTO attendance_rollups (name, week, role, checkIns, late, fines) VALUES (?, ?, ?, 1, ?, ?)
+                     ON CONFLICT (name, week) DO UPDATE SET role=excluded.role, checkIns=checkIns+1,
+                     late=late+excluded.late, fines=fines+excluded.fines''',
+                  (name, week, role, int(late), fine))
+        bump_attendance_version(c)
+        invalidate_statement(c, name)
         conn.commit()
     receipt_text = f'''Attendance Receipt\nName: {name}\nRole: {role}\nDate: {date_}\nTime: {time_}
 Status: {status}\nFine: {format_ugx(fine)}\nTimestamp: {timestamp()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/attendance')
+@route('/attendance')
 def get_attendance():
     with get_db() as conn:
         c = conn.cursor()
@@ -506,7 +732,66 @@ def get_attendance():
         attendance = [dict(row) for row in c.fetchall()]
     return jsonify(attendance)
 
-@app.route('/assign_duty', methods=['POST'])
+LEADERBOARD_ORDER = {'late': 'late', 'fines': 'fines', 'lateRate': 'lateRate', 'checkIns': 'checkIns'}
+
+@route('/attendance/leaderboard')
+def attendance_leaderboard():
+    by = request.args.get('by', 'late')
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    since = request.args.get('since')
+    if by not in LEADERBOARD_ORDER:
+        return jsonify({'error': f'Sort by one of {", ".join(LEADERBOARD_ORDER)}'}), 400
+    try:
+        since_week = attendance_week(since) if since else ''
+    except ValueError:
+        return jsonify({'error': 'Give since as YYYY-MM-DD'}), 400
+
+    def compute(c):
+        c.execute(f'''SELECT name, SUM(checkIns) AS checkIns, SUM(late) AS late, SUM(fines) AS fines,
+                      ROUND(1.0 * SUM(late) / SUM(checkIns), 3) AS lateRate
+                      FROM attendance_rollups WHERE week >= ? GROUP BY name
+                      ORDER BY {LEADERBOARD_ORDER[by]} DESC, name LIMIT ?''', (since_week, limit))
+        return [dict(row) for row in c.fetchall()]
+
+    with get_db() as conn:
+        leaders = cached_analytics(conn.cursor(), ('leaderboard', by, limit, since_week), compute)
+    return jsonify(leaders)
+
+@route('/attendance/trend')
+def attendance_trend():
+    weeks = max(1, min(request.args.get('weeks', 12, type=int), 520))
+
+    def compute(c):
+        c.execute('''SELECT week, COUNT(name) AS members, SUM(checkIns) AS checkIns, SUM(late) AS late,
+                     SUM(fines) AS fines, ROUND(1.0 * SUM(late) / SUM(checkIns), 3) AS lateRate
+                     FROM attendance_rollups GROUP BY week ORDER BY week DESC LIMIT ?''', (weeks,))
+        return [dict(row) for row in reversed(c.fetchall())]
+
+    with get_db() as conn:
+        trend = cached_analytics(conn.cursor(), ('trend', weeks), compute)
+    return jsonify(trend)
+
+@route('/attendance/member/<name>')
+def attendance_member(name):
+    def compute(c):
+        c.execute('SELECT week, role, checkIns, late, fines FROM attendance_rollups WHERE name=? ORDER BY week', (name,))
+        weeks = [dict(row) for row in c.fetchall()]
+        check_ins = sum(w['checkIns'] for w in weeks)
+        late = sum(w['late'] for w in weeks)
+        return {
+            'name': name,
+            'checkIns': check_ins,
+            'late': late,
+            'fines': sum(w['fines'] for w in weeks),
+            'lateRate': round(late / check_ins, 3) if check_ins else 0,
+            'weeks': weeks
+        }
+
+    with get_db() as conn:
+        summary = cached_analytics(conn.cursor(), ('member', name), compute)
+    return jsonify(summary)
+
+@route('/assign_duty', methods=['POST'])
 def assign_duty():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -524,7 +809,7 @@ def assign_duty():
         conn.commit()
     return jsonify({'message': 'Duty assigned'})
 
-@app.route('/duties')
+@route('/duties')
 def get_duties():
     with get_db() as conn:
         c = conn.cursor()
@@ -532,7 +817,7 @@ def get_duties():
         duties = [dict(row) for row in c.fetchall()]
     return jsonify(duties)
 
-@app.route('/register_student', methods=['POST'])
+@route('/register_student', methods=['POST'])
 def register_student():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -552,7 +837,7 @@ def register_student():
     receipt_text = f'''Student Registration\nName: {name}\nClass: {cls}\nStream: {stream}\nHouse: {house}\nDate: {date_} {now_time()}'''
     return jsonify({'receipt': receipt_text})
 
-@app.route('/students')
+@route('/students')
 def get_students():
     with get_db() as conn:
         c = conn.cursor()
@@ -560,25 +845,35 @@ def get_students():
         students = [dict(row) for row in c.fetchall()]
     return jsonify(students)
 
-@app.route('/send_message', methods=['POST'])
+@route('/send_message', methods=['POST'])
 def send_message():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
     from_user = request.form.get('from')
     to_user = request.form.get('to')
     content = request.form.get('content')
+    reply_to = request.form.get('reply_to')
     date_ = request.form.get('date') or now_date()
     if not all([from_user, to_user, content]):
         return jsonify({'error': 'Fill message fields'}), 400
     rec_id = f'MSG{int(datetime.now().timestamp()*1000)}'
     with get_db() as conn:
         c = conn.cursor()
-        c.execute('INSERT INTO messages (id, from_user, to_user, content, date, time, read) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                  (rec_id, from_user, to_user, content, date_, now_time(), 0))
+        thread_id = rec_id
+        if reply_to:
+            c.execute('SELECT threadId FROM messages WHERE id=?', (reply_to,))
+            parent = c.fetchone()
+            if not parent:
+                return jsonify({'error': 'Message to reply to not found'}), 404
+            thread_id = parent['threadId']
+        c.execute('INSERT INTO messages (id, from_user, to_user, content, date, time, read, threadId) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                  (rec_id, from_user, to_user, content, date_, now_time(), 0, thread_id))
+        c.execute('''INSERT INTO unread_counts (to_user, unread) VALUES (?, 1)
+                     ON CONFLICT (to_user) DO UPDATE SET unread=unread+1''', (to_user,))
         conn.commit()
-    return jsonify({'message': 'Message sent'})
+    return jsonify({'message': 'Message sent', 'id': rec_id, 'threadId': thread_id})
 
-@app.route('/messages')
+@route('/messages')
 def get_messages():
     with get_db() as conn:
         c = conn.cursor()
@@ -586,7 +881,125 @@ def get_messages():
         messages = [dict(row) for row in c.fetchall()]
     return jsonify(messages)
 
-@app.route('/set_finance_pin', methods=['POST'])
+INBOX_PAGE_SIZE = 20
+
+@route('/inbox')
+def inbox():
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    limit = max(1, min(request.args.get('limit', INBOX_PAGE_SIZE, type=int), 100))
+    cursor = request.args.get('cursor')
+    query = 'SELECT * FROM messages WHERE to_user=?'
+    params = [session['role']]
+    if parse_flag(request.args.get('unread')):
+        query += ' AND read=0'
+    if cursor:
+        # Cursor is the (date, time, id) of the last message on the previous page
+        try:
+            cur_date, cur_time, cur_id = cursor.split('|')
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query += ' AND (date, time, id) < (?, ?, ?)'
+        params += [cur_date, cur_time, cur_id]
+    query += ' ORDER BY date DESC, time DESC, id DESC LIMIT ?'
+    params.append(limit + 1)
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute(query, params)
+        messages = [dict(row) for row in c.fetchall()]
+    next_cursor = None
+    if len(messages) > limit:
+        messages = messages[:limit]
+        last = messages[-1]
+        next_cursor = f"{last['date']}|{last['time']}|{last['id']}"
+    return jsonify({'messages': messages, 'nextCursor': next_cursor})
+
+@route('/inbox/unread_count')
+def unread_count():
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT unread FROM unread_counts WHERE to_user=?', (session['role'],))
+        row = c.fetchone()
+    return jsonify({'unread': row['unread'] if row else 0})
+
+@route('/thread/<thread_id>')
+def get_thread(thread_id):
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    with get_db() as conn:
+        c = conn.cursor()
+        # Only the messages this role sent or received; a thread it is not part of is not found
+        c.execute('''SELECT * FROM messages WHERE threadId=? AND (to_user=? OR from_user=?)
+                     ORDER BY date, time, id''', (thread_id, session['role'], session['role']))
+        messages = [dict(row) for row in c.fetchall()]
+    if not messages:
+        return jsonify({'error': 'Thread not found'}), 404
+    return jsonify(messages)
+
+@route('/messages/mark_read', methods=['POST'])
+def mark_messages_read():
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    role = session['role']
+    ids = [i for i in request.form.get('ids', '').split(',') if i]
+    thread_id = request.form.get('thread')
+    mark_all = parse_flag(request.form.get('all'))
+    if not (ids or thread_id or mark_all):
+        return jsonify({'error': 'Give message ids, a thread or all'}), 400
+    with get_db() as conn:
+        c = conn.cursor()
+        if mark_all:
+            c.execute('UPDATE messages SET read=1 WHERE to_user=? AND read=0', (role,))
+        elif thread_id:
+            c.execute('UPDATE messages SET read=1 WHERE to_user=? AND read=0 AND threadId=?', (role, thread_id))
+        else:
+            c.execute(f'UPDATE messages SET read=1 WHERE to_user=? AND read=0 AND id IN ({",".join("?" * len(ids))})',
+                      [role] + ids)
+        marked = c.rowcount
+        c.execute('UPDATE unread_counts SET unread=MAX(0, unread-?) WHERE to_user=?', (marked, role))
+        conn.commit()
+    return jsonify({'message': f'{marked} marked read', 'marked': marked})
+
+@route('/statement/<name>')
+def get_person_statement(name):
+    with get_db() as conn:
+        c = conn.cursor()
+        statement = get_statement(c, name)
+    return jsonify(statement)
+
+@route('/outstanding_balances')
+def outstanding_balances():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT name FROM payments UNION SELECT name FROM minister_payments UNION SELECT name FROM loans
+                     UNION SELECT name FROM savings UNION SELECT name FROM attendance''')
+        names = [row['name'] for row in c.fetchall() if row['name']]
+        statements, built = [], []
+        for name in names:
+            st, version = load_statement(c, name)
+            if st is None:
+                st = build_statement(c, name)
+                built.append((name, version, st))
+            statements.append(st)
+        # Rebuilt statements are cached together in one short write at the end
+        store_statements(c, built)
+        report = []
+        for st in statements:
+            name = st['name']
+            loan_outstanding = st['loan']['payoff'] if st['loan'] else 0
+            if st['feesOutstanding'] or loan_outstanding or st['fines']['unpaid']:
+                report.append({'name': name, 'feesOutstanding': st['feesOutstanding'],
+                               'loanOutstanding': loan_outstanding, 'unpaidFines': st['fines']['unpaid'],
+                               'total': st['feesOutstanding'] + loan_outstanding + st['fines']['unpaid']})
+    return jsonify({
+        'asOf': now_date(),
+        'balances': report,
+        'totalOutstanding': sum(r['total'] for r in report)
+    })
+
+@route('/set_finance_pin', methods=['POST'])
 def set_finance_pin():
     if 'role' not in session or session['role'] != 'Finance':
         return jsonify({'error': 'Unauthorized'}), 401
@@ -604,7 +1017,7 @@ def set_finance_pin():
         conn.commit()
     return jsonify({'message': 'Finance PIN set'})
 
-@app.route('/override_finance_pin', methods=['POST'])
+@route('/override_finance_pin', methods=['POST'])
 def override_finance_pin():
     if 'role' not in session or session['role'] not in ['Patron', 'President']:
         return jsonify({'error': 'Only Patron or President can override'}), 401
@@ -621,7 +1034,7 @@ def override_finance_pin():
         conn.commit()
     return jsonify({'message': 'Finance PIN overridden and set'})
 
-@app.route('/clear_all_data', methods=['POST'])
+@route('/clear_all_data', methods=['POST'])
 def clear_all_data():
     if 'role' not in session or session['role'] != 'Finance':
         return jsonify({'error': 'Unauthorized'}), 401
@@ -638,15 +1051,14 @@ def clear_all_data():
             DELETE FROM payments; DELETE FROM expenditures; DELETE FROM loans; DELETE FROM repayments;
             DELETE FROM savings; DELETE FROM minister_payments; DELETE FROM incomes; DELETE FROM attendance;
             DELETE FROM duties; DELETE FROM students; DELETE FROM messages;
-            UPDATE state SET totalCollected=0, totalExpenditure=0 WHERE id=1;
+            UPDATE statements SET data=NULL, version=version+1;
+            DELETE FROM attendance_rollups; DELETE FROM unread_counts;
+            UPDATE state SET totalCollected=0, totalExpenditure=0, attendanceVersion=attendanceVersion+1 WHERE id=1;
         ''')
         conn.commit()
     return jsonify({'message': 'All data cleared'})
 
-@app.route('/export_data')
-def export_data():
-    if 'role' not in session:
-        return jsonify({'error': 'Not logged in'}), 401
+def export_state():
     with get_db() as conn:
         c = conn.cursor()
         state = {
@@ -665,13 +1077,302 @@ def export_data():
             'totalExpenditure': c.execute('SELECT totalExpenditure FROM state WHERE id=1').fetchone()['totalExpenditure'],
             'financePin': c.execute('SELECT financePin FROM state WHERE id=1').fetchone()['financePin']
         }
-    data_str = json.dumps(state, indent=2)
-    output = io.BytesIO()
-    output.write(data_str.encode('utf-8'))
-    output.seek(0)
-    return send_file(output, download_name=f'gcc_cabinet_data_{now_date()}.json', as_attachment=True)
+    conn.close()
+    return state
+
+def import_state(state):
+    with get_db() as conn:
+        c = conn.cursor()
+        c.executescript('''
+            DELETE FROM payments; DELETE FROM expenditures; DELETE FROM loans; DELETE FROM repayments;
+            DELETE FROM savings; DELETE FROM minister_payments; DELETE FROM incomes; DELETE FROM attendance;
+            DELETE FROM duties; DELETE FROM students; DELETE FROM messages;
+            UPDATE statements SET data=NULL, version=version+1;
+            DELETE FROM attendance_rollups; DELETE FROM unread_counts;
+        ''')
+        for p in state.get('payments', []):
+            c.execute('''INSERT INTO payments (id, name, cls, stream, house, type, term, amount, required, balance, date, time)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (p['id'], p['name'], p['cls'], p['stream'], p['house'], p['type'], p['term'], p['amount'], p['required'], p['balance'], p['date'], p.get('time')))
+        for e in state.get('expenditures', []):
+            c.execute('INSERT INTO expenditures (id, desc, amt, date, time) VALUES (?, ?, ?, ?, ?)',
+                      (e['id'], e['desc'], e['amt'], e['date'], e.get('time')))
+        for l in state.get('loans', []):
+            c.execute('''INSERT INTO loans (id, name, principal, interestPct, total, totalRemaining, status, date, dueDate, disbursed)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (l['id'], l['name'], l['principal'], l['interestPct'], l['total'], l['totalRemaining'], l['status'], l['date'], l['dueDate'], l['disbursed']))
+        for r in state.get('repayments', []):
+            c.execute('INSERT INTO repayments (id, loanId, name, paid, balance, date) VALUES (?, ?, ?, ?, ?, ?)',
+                      (r['id'], r['loanId'], r['name'], r['paid'], r['balance'], r['date']))
+        for s in state.get('savings', []):
+            c.execute('''INSERT INTO savings (id, name, amount, dateSaved, sched, termWeeks, interestPct, interestIfHeld, daysScheduled, withdrawn)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                      (s['id'], s['name'], s['amount'], s['dateSaved'], s['sched'], s['termWeeks'], s['interestPct'], s['interestIfHeld'], s['daysScheduled'], s['withdrawn']))
+        for m in state.get('ministerPayments', []):
+            c.execute('INSERT INTO minister_payments (id, name, type, required, paid, balance, date) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (m['id'], m['name'], m['type'], m['required'], m['paid'], m['balance'], m['date']))
+        for i in state.get('incomes', []):
+            c.execute('INSERT INTO incomes (id, source, amt, date, time, attendanceId) VALUES (?, ?, ?, ?, ?, ?)',
+                      (i['id'], i['source'], i['amt'], i['date'], i.get('time'), i.get('attendanceId')))
+        for a in state.get('attendance', []):
+            c.execute('INSERT INTO attendance (id, name, role, date, time, status, fine) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                      (a['id'], a['name'], a['role'], a['date'], a['time'], a['status'], a['fine']))
+        for d in state.get('duties', []):
+            c.execute('INSERT INTO duties (id, name, role, task, week) VALUES (?, ?, ?, ?, ?)',
+                      (d['id'], d['name'], d['role'], d['task'], d['week']))
+        for s in state.get('students', []):
+            c.execute('INSERT INTO students (id, name, cls, stream, house, date) VALUES (?, ?, ?, ?, ?, ?)',
+                      (s['id'], s['name'], s['cls'], s['stream'], s['house'], s['date']))
+        for m in state.get('messages', []):
+            c.execute('INSERT INTO messages (id, from_user, to_user, content, date, time, read, threadId) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (m['id'], m['from_user'], m['to_user'], m['content'], m['date'], m['time'], m['read'], m.get('threadId')))
+        link_fines(c)
+        c.execute(REBUILD_ROLLUPS_SQL)
+        bump_attendance_version(c)
+        c.execute(THREAD_BACKFILL_SQL)
+        c.execute(REBUILD_UNREAD_SQL)
+        c.execute('UPDATE state SET totalCollected=?, totalExpenditure=?, financePin=? WHERE id=1',
+                  (state.get('totalCollected', 0), state.get('totalExpenditure', 0), state.get('financePin')))
+        conn.commit()
+    conn.close()
+
+def render_receipt_pdf(text):
+    # reportlab is slow to import and only needed here, so load it on first use
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=letter)
+    lines = text.split('\n')
+    y = 750
+    for line in lines:
+        c.drawString(30, y, line)
+        y -= 15
+    c.save()
+    return buffer.getvalue()
+
+# Job functions run in the process pool. Each returns (data, download_name, message);
+# download_name is None when the job only reports a message.
+def export_job(payload):
+    data_str = json.dumps(export_state(), indent=2)
+    return data_str.encode('utf-8'), f'gcc_cabinet_data_{now_date()}.json', None
+
+def import_job(payload):
+    try:
+        state = json.loads(payload)
+    except json.JSONDecodeError:
+        raise ValueError('Invalid JSON file')
+    import_state(state)
+    return None, None, 'Data imported'
+
+def receipt_job(payload):
+    return render_receipt_pdf(payload.decode('utf-8')), 'receipt.pdf', None
+
+# Heavy endpoints queue a job and return its id instead of doing the work in the request
+# worker. A dispatcher thread in each app process claims queued jobs (lowest priority
+# number first) while keeping each kind under its concurrency limit across all processes,
+# and runs them in a process pool. Enqueueing is refused once max_queued jobs of a kind wait.
+JOB_KINDS = {
+    'receipt': {'func': receipt_job, 'priority': 0, 'concurrency': 2, 'max_queued': 20},
+    'import': {'func': import_job, 'priority': 1, 'concurrency': 1, 'max_queued': 2},
+    'export': {'func': export_job, 'priority': 2, 'concurrency': 1, 'max_queued': 5},
+}
+JOB_POOL_SIZE = 2
+JOB_POLL_INTERVAL = 0.2
+# Finished jobs and their results are kept this long for polling clients and metrics
+JOB_RETENTION = 3600
+# How often each dispatcher sweeps lost jobs and purges old ones
+JOB_HOUSEKEEPING_INTERVAL = 60
+# Backstop for a running job whose outcome was never recorded
+JOB_HARD_TIMEOUT = 3600
+# Job writes retry "database is locked" with backoff (0.5s, 1s, 2s, ...) before giving up
+JOB_WRITE_ATTEMPTS = 6
+
+_job_dispatcher = {'pid': None, 'pool': None}
+_job_dispatcher_lock = threading.Lock()
+
+def ensure_job_dispatcher():
+    # One dispatcher and pool per process; the pid check restarts them in freshly forked
+    # workers. Returns the process pool.
+    with _job_dispatcher_lock:
+        if _job_dispatcher['pid'] != os.getpid():
+            _job_dispatcher['pid'] = os.getpid()
+            _job_dispatcher['pool'] = new_job_pool()
+            threading.Thread(target=dispatch_jobs, name='job-dispatcher', daemon=True).start()
+        return _job_dispatcher['pool']
+
+def new_job_pool():
+    # spawn rather than fork: this process already runs threads
+    return ProcessPoolExecutor(max_workers=JOB_POOL_SIZE, mp_context=multiprocessing.get_context('spawn'))
+
+def dispatch_jobs():
+    pool = _job_dispatcher['pool']
+    slots = threading.Semaphore(JOB_POOL_SIZE)
+    last_housekeeping = 0
+    while True:
+        if time.monotonic() - last_housekeeping >= JOB_HOUSEKEEPING_INTERVAL:
+            try:
+                housekeep_jobs()
+            except sqlite3.Error as e:
+                logger.warning('Job housekeeping failed: %s', e)
+            last_housekeeping = time.monotonic()
+        if not slots.acquire(timeout=JOB_HOUSEKEEPING_INTERVAL):
+            continue
+        try:
+            job = claim_job()
+        except sqlite3.Error as e:
+            logger.warning('Job claim failed: %s', e)
+            job = None
+        if not job:
+            slots.release()
+            time.sleep(JOB_POLL_INTERVAL)
+            continue
+        try:
+            future = pool.submit(run_job, job['id'], job['kind'], job['payload'])
+        except Exception as e:
+            # Usually BrokenProcessPool after a pool process died; replace the pool
+            logger.warning('Job %s could not start: %s', job['id'], e)
+            slots.release()
+            pool.shutdown(wait=False)
+            pool = _job_dispatcher['pool'] = new_job_pool()
+            try:
+                fail_job(job['id'], f'Could not start: {e}')
+            except sqlite3.Error as e:
+                logger.warning('Job %s could not be marked failed: %s', job['id'], e)
+            continue
+        future.add_done_callback(job_done_callback(job['id'], slots))
+
+def job_done_callback(job_id, slots):
+    def done(future):
+        try:
+            error = future.exception()
+            if error:
+                # run_job records its own outcome, so this is a pool process that died or
+                # could not write to the database
+                fail_job(job_id, str(error) or type(error).__name__)
+        except sqlite3.Error as e:
+            logger.warning('Job %s could not be marked failed: %s', job_id, e)
+        finally:
+            slots.release()
+    return done
+
+def run_job(job_id, kind, payload):
+    # Runs in a pool process, which records itself as the job's owner first so that
+    # housekeep_jobs can tell when the process running a job has gone away, and then
+    # writes the job's outcome itself
+    write_job('UPDATE jobs SET owner=? WHERE id=?', (os.getpid(), job_id))
+    try:
+        data, download_name, message = JOB_KINDS[kind]['func'](payload)
+    except Exception as e:
+        fail_job(job_id, str(e))
+        return
+    write_job('''UPDATE jobs SET status='done', result=?, resultName=?, message=?, finished=?
+                 WHERE status='running' AND id=?''', (data, download_name, message, time.time(), job_id))
+
+def write_job(sql, params):
+    for attempt in range(JOB_WRITE_ATTEMPTS):
+        conn = get_db()
+        try:
+            conn.execute(sql, params)
+            conn.commit()
+            return
+        except sqlite3.OperationalError as e:
+            if attempt == JOB_WRITE_ATTEMPTS - 1:
+                raise
+            logger.warning('Job write failed (%s), retrying', e)
+        finally:
+            conn.close()
+        time.sleep(0.5 * 2 ** attempt)
+
+def process_alive(pid):
+    if os.name == 'nt':
+        # os.kill would terminate the process on Windows; only gunicorn (POSIX) recycles workers
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def housekeep_jobs():
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        now = time.time()
+        # A running job is given up on once its owning process is gone, or as a backstop
+        # after JOB_HARD_TIMEOUT, so its concurrency slot is not freed while the work may
+        # still be going on
+        c.execute("SELECT id, owner, started FROM jobs WHERE status='running'")
+        lost, expired = [], []
+        for row in c.fetchall():
+            if row['owner'] and not process_alive(row['owner']):
+                lost.append((now, row['id']))
+            elif row['started'] < now - JOB_HARD_TIMEOUT:
+                expired.append((now, row['id']))
+        c.executemany('''UPDATE jobs SET status='failed', error='Process running the job exited', finished=?
+                         WHERE status='running' AND id=?''', lost)
+        c.executemany('''UPDATE jobs SET status='failed', error='Job timed out', finished=?
+                         WHERE status='running' AND id=?''', expired)
+        c.execute('DELETE FROM jobs WHERE finished < ?', (now - JOB_RETENTION,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def claim_job():
+    conn = get_db()
+    try:
+        c = conn.cursor()
+        # Plain read first so an idle poll never takes the write lock
+        c.execute("SELECT kind, status, COUNT(*) AS n FROM jobs WHERE status IN ('queued', 'running') GROUP BY kind, status")
+        counts = {(row['kind'], row['status']): row['n'] for row in c.fetchall()}
+        if not any(counts.get((k, 'queued')) and counts.get((k, 'running'), 0) < cfg['concurrency']
+                   for k, cfg in JOB_KINDS.items()):
+            return None
+        c.execute('BEGIN IMMEDIATE')
+        now = time.time()
+        c.execute("SELECT kind, COUNT(*) AS n FROM jobs WHERE status='running' GROUP BY kind")
+        running = {row['kind']: row['n'] for row in c.fetchall()}
+        kinds = [k for k, cfg in JOB_KINDS.items() if running.get(k, 0) < cfg['concurrency']]
+        job = None
+        if kinds:
+            c.execute(f'''SELECT id, kind, payload FROM jobs WHERE status='queued' AND kind IN ({",".join("?" * len(kinds))})
+                          ORDER BY priority, created LIMIT 1''', kinds)
+            job = c.fetchone()
+            if job:
+                # The dispatcher owns the job until run_job hands it to a pool process
+                c.execute("UPDATE jobs SET status='running', started=?, owner=? WHERE id=?",
+                          (now, os.getpid(), job['id']))
+        conn.commit()
+        return job
+    finally:
+        conn.close()
+
+def fail_job(job_id, error):
+    write_job("UPDATE jobs SET status='failed', error=?, finished=? WHERE status='running' AND id=?",
+              (error, time.time(), job_id))
+
+def enqueue_job(kind, payload):
+    cfg = JOB_KINDS[kind]
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute("SELECT COUNT(*) FROM jobs WHERE kind=? AND status='queued'", (kind,))
+        if c.fetchone()[0] >= cfg['max_queued']:
+            return jsonify({'error': f'Too many {kind} jobs queued, try again shortly'}), 503
+        job_id = f'JOB{int(datetime.now().timestamp()*1000)}{os.urandom(4).hex()}'
+        c.execute('INSERT INTO jobs (id, kind, status, priority, payload, created) VALUES (?, ?, ?, ?, ?, ?)',
+                  (job_id, kind, 'queued', cfg['priority'], payload, time.time()))
+        conn.commit()
+    ensure_job_dispatcher()
+    return jsonify({'jobId': job_id, 'status': 'queued', 'statusUrl': url_for('job_status', job_id=job_id)}), 202
+
+@route('/export_data')
+def export_data():
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    return enqueue_job('export', None)
 
-@app.route('/import_data', methods=['POST'])
+@route('/import_data', methods=['POST'])
 def import_data():
     if 'role' not in session:
         return jsonify({'error': 'Not logged in'}), 401
@@ -680,74 +1381,143 @@ def import_data():
     file = request.files['file']
     if not file.filename.endswith('.json'):
         return jsonify({'error': 'Invalid file type'}), 400
-    try:
-        state = json.load(file)
-        with get_db() as conn:
-            c = conn.cursor()
-            c.executescript('''
-                DELETE FROM payments; DELETE FROM expenditures; DELETE FROM loans; DELETE FROM repayments;
-                DELETE FROM savings; DELETE FROM minister_payments; DELETE FROM incomes; DELETE FROM attendance;
-                DELETE FROM duties; DELETE FROM students; DELETE FROM messages;
-            ''')
-            for p in state.get('payments', []):
-                c.execute('''INSERT INTO payments (id, name, cls, stream, house, type, term, amount, required, balance, date, time)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (p['id'], p['name'], p['cls'], p['stream'], p['house'], p['type'], p['term'], p['amount'], p['required'], p['balance'], p['date'], p.get('time')))
-            for e in state.get('expenditures', []):
-                c.execute('INSERT INTO expenditures (id, desc, amt, date, time) VALUES (?, ?, ?, ?, ?)',
-                          (e['id'], e['desc'], e['amt'], e['date'], e.get('time')))
-            for l in state.get('loans', []):
-                c.execute('''INSERT INTO loans (id, name, principal, interestPct, total, totalRemaining, status, date, dueDate, disbursed)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (l['id'], l['name'], l['principal'], l['interestPct'], l['total'], l['totalRemaining'], l['status'], l['date'], l['dueDate'], l['disbursed']))
-            for r in state.get('repayments', []):
-                c.execute('INSERT INTO repayments (id, loanId, name, paid, balance, date) VALUES (?, ?, ?, ?, ?, ?)',
-                          (r['id'], r['loanId'], r['name'], r['paid'], r['balance'], r['date']))
-            for s in state.get('savings', []):
-                c.execute('''INSERT INTO savings (id, name, amount, dateSaved, sched, termWeeks, interestPct, interestIfHeld, daysScheduled, withdrawn)
-                             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
-                          (s['id'], s['name'], s['amount'], s['dateSaved'], s['sched'], s['termWeeks'], s['interestPct'], s['interestIfHeld'], s['daysScheduled'], s['withdrawn']))
-            for m in state.get('ministerPayments', []):
-                c.execute('INSERT INTO minister_payments (id, name, type, required, paid, balance, date) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                          (m['id'], m['name'], m['type'], m['required'], m['paid'], m['balance'], m['date']))
-            for i in state.get('incomes', []):
-                c.execute('INSERT INTO incomes (id, source, amt, date, time) VALUES (?, ?, ?, ?, ?)',
-                          (i['id'], i['source'], i['amt'], i['date'], i.get('time')))
-            for a in state.get('attendance', []):
-                c.execute('INSERT INTO attendance (id, name, role, date, time, status, fine) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                          (a['id'], a['name'], a['role'], a['date'], a['time'], a['status'], a['fine']))
-            for d in state.get('duties', []):
-                c.execute('INSERT INTO duties (id, name, role, task, week) VALUES (?, ?, ?, ?, ?)',
-                          (d['id'], d['name'], d['role'], d['task'], d['week']))
-            for s in state.get('students', []):
-                c.execute('INSERT INTO students (id, name, cls, stream, house, date) VALUES (?, ?, ?, ?, ?, ?)',
-                          (s['id'], s['name'], s['cls'], s['stream'], s['house'], s['date']))
-            for m in state.get('messages', []):
-                c.execute('INSERT INTO messages (id, from_user, to_user, content, date, time, read) VALUES (?, ?, ?, ?, ?, ?, ?)',
-                          (m['id'], m['from_user'], m['to_user'], m['content'], m['date'], m['time'], m['read']))
-            c.execute('UPDATE state SET totalCollected=?, totalExpenditure=?, financePin=? WHERE id=1',
-                      (state.get('totalCollected', 0), state.get('totalExpenditure', 0), state.get('financePin')))
-            conn.commit()
-    except json.JSONDecodeError:
-        return jsonify({'error': 'Invalid JSON file'}), 400
-    return jsonify({'message': 'Data imported'})
+    return enqueue_job('import', file.read())
 
-@app.route('/download_receipt', methods=['POST'])
+@route('/download_receipt', methods=['POST'])
 def download_receipt():
     text = request.form.get('text')
     if not text:
         return jsonify({'error': 'No receipt text provided'}), 400
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    lines = text.split('\n')
-    y = 750
-    for line in lines:
-        c.drawString(30, y, line)
-        y -= 15
-    c.save()
-    buffer.seek(0)
-    return send_file(buffer, download_name='receipt.pdf', as_attachment=True)
+    return enqueue_job('receipt', text.encode('utf-8'))
+
+@route('/jobs/metrics')
+def job_metrics():
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT kind, status, COUNT(*) AS n, AVG(finished - started) AS avgRun,
+                     MAX(finished - started) AS maxRun, AVG(started - created) AS avgWait
+                     FROM jobs GROUP BY kind, status''')
+        rows = c.fetchall()
+    metrics = {kind: {'queued': 0, 'running': 0, 'done': 0, 'failed': 0, 'priority': cfg['priority'],
+                      'concurrency': cfg['concurrency'], 'maxQueued': cfg['max_queued'],
+                      'avgDurationMs': None, 'maxDurationMs': None, 'avgWaitMs': None}
+               for kind, cfg in JOB_KINDS.items()}
+    for row in rows:
+        m = metrics.get(row['kind'])
+        if not m:
+            continue
+        m[row['status']] = row['n']
+        if row['status'] == 'done':
+            m['avgDurationMs'] = round(row['avgRun'] * 1000, 1)
+            m['maxDurationMs'] = round(row['maxRun'] * 1000, 1)
+            m['avgWaitMs'] = round(row['avgWait'] * 1000, 1)
+    return jsonify({
+        'queueDepth': sum(m['queued'] for m in metrics.values()),
+        'kinds': metrics
+    })
+
+@route('/jobs/<job_id>')
+def job_status(job_id):
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('''SELECT id, kind, status, resultName, message, error, created, started, finished
+                     FROM jobs WHERE id=?''', (job_id,))
+        job = c.fetchone()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    job = dict(job)
+    if job['status'] == 'done' and job['resultName']:
+        job['resultUrl'] = url_for('job_result', job_id=job_id)
+    return jsonify(job)
+
+@route('/jobs/<job_id>/result')
+def job_result(job_id):
+    if 'role' not in session:
+        return jsonify({'error': 'Not logged in'}), 401
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT status, result, resultName FROM jobs WHERE id=?', (job_id,))
+        job = c.fetchone()
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['status'] != 'done' or job['result'] is None:
+        return jsonify({'error': f"Job is {job['status']}, no result to download"}), 409
+    return send_file(io.BytesIO(job['result']), download_name=job['resultName'], as_attachment=True)
+
+def log_timings(label, timings):
+    logger.info('%s: %s', label, ', '.join(f'{phase} {ms:.1f}ms' for phase, ms in timings.items()))
+
+def warm_job_process():
+    # Run in each pool process at warmup so the first receipt after a worker restart
+    # does not pay for process spawn and the reportlab import
+    from reportlab.pdfgen import canvas
+    return os.getpid()
+
+def warm_worker(app):
+    # Per-process warmup, run after fork. Requests open their own connections, so the
+    # database read only pulls the schema and state pages into the OS page cache; the
+    # lasting per-worker gains are the compiled page template and a started job pool
+    timings = {}
+    start = time.perf_counter()
+    with get_db() as conn:
+        c = conn.cursor()
+        c.execute('SELECT name FROM sqlite_master').fetchall()
+        c.execute('SELECT totalCollected, totalExpenditure FROM state WHERE id=1').fetchone()
+    conn.close()
+    timings['db'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    try:
+        app.jinja_env.get_template('index.html')
+    except TemplateError as e:
+        # Warmup is best-effort; the error surfaces again on the first page request
+        logger.warning('Template warmup failed: %s', e)
+    timings['templates'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    pool = ensure_job_dispatcher()
+    for _ in range(JOB_POOL_SIZE):
+        # Pool processes come up in the background; each logs when it is ready
+        pool.submit(warm_job_process).add_done_callback(lambda f, start=start: logger.info(
+            'Job pool process %s ready in %.1fms', f.result() if not f.exception() else 'failed',
+            (time.perf_counter() - start) * 1000))
+    timings['pool'] = (time.perf_counter() - start) * 1000
+    log_timings(f'Worker {os.getpid()} warmup', timings)
+    return timings
+
+# Databases whose schema has been created and migrated by this process
+_schema_ready = set()
+
+def create_app():
+    # Application factory: builds a new app with every route registered, creating and
+    # migrating the schema the first time a process sees the database. Under gunicorn
+    # with preload_app this runs in the master before workers fork; see gunicorn.conf.py
+    # for the per-worker warmup.
+    if default_handler not in logger.handlers:
+        logger.addHandler(default_handler)
+    logger.setLevel(logging.INFO)
+    timings = {'import': IMPORT_TIME_MS}
+    start = time.perf_counter()
+    app = Flask(__name__)
+    app.secret_key = 'gcc_cabinet_secret_key_2025'
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    timings['app'] = (time.perf_counter() - start) * 1000
+    if DATABASE not in _schema_ready:
+        start = time.perf_counter()
+        init_db()
+        _schema_ready.add(DATABASE)
+        timings['schema'] = (time.perf_counter() - start) * 1000
+    app.config['STARTUP_TIMINGS'] = timings
+    log_timings('Startup', timings)
+    return app
+
+IMPORT_TIME_MS = (time.perf_counter() - _import_start) * 1000
 
 if __name__ == '__main__':
-    init_db()
+    app = create_app()
+    # The debug reloader re-runs this file in a serving child; only that child warms up
+    # and runs jobs, so the watching parent never executes stale code
+    if os.environ.get('WERKZEUG_RUN_MAIN'):
+        warm_worker(app)
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,19 @@
+# Gunicorn settings for the cabinet app: gunicorn -c gunicorn.conf.py
+import time
+
+_import_start = time.perf_counter()
+
+wsgi_app = 'app:create_app()'
+bind = '0.0.0.0:8000'
+workers = 2
+# Load the app and run schema setup once in the master; workers fork from it
+preload_app = True
+
+
+def when_ready(server):
+    server.log.info('Master ready in %.1fms', (time.perf_counter() - _import_start) * 1000)
+
+
+def post_fork(server, worker):
+    from app import warm_worker
+    warm_worker(server.app.wsgi())